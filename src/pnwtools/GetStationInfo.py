@@ -20,11 +20,11 @@ def main():
     dir_name = os.path.basename(target_dir)
     stn_info_path = os.path.join(target_dir, "{0}_station_info.csv".format(dir_name))
     
-    stn_info = pnwtools.buildStationDict(target_dir)
+    stn_info = pnwtools.buildStationDictCached(target_dir)
     stn_info_lines = pnwtools.buildStationTable(stn_info)
 
     with open(stn_info_path, 'w') as stn_info_file:
-        stn_info_file.write('\n'.join(stn_info_lines))
+        stn_info_file.writelines(line + '\n' for line in stn_info_lines)
     
     print(" done.\n")
     
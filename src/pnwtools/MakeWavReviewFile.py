@@ -27,7 +27,6 @@ Usage:
 
 import os
 import sys
-from math import log10
 from pnwtools import makeWavDict, makeWavLines
 
 
@@ -46,14 +45,16 @@ def main():
     wavs = makeWavDict(target_dir)
     print("{0:,} .wav files found in target directory.".format(len(wavs)))
 
-    outlines = [header]
-    for x in sorted(wavs):
-        outlines.extend(makeWavLines(wavs[x], target_dir, clip_length, interval))
-
+    n_lines = 0
     with open(output_path, 'w') as outfile:
-        outfile.write('\n'.join(outlines))
-
-    print("{0:,} lines written to {1}.".format(len(outlines) - 1, os.path.basename(output_path)))
+        outfile.write(header + '\n')
+        # Sort by station prefix, then by timestamp, straight from the 
+        # filename. Plain sorting puts all of station "-10" before 
+        # station "-1", because "0" sorts before "_"
+        for x in sorted(wavs, key=lambda name: name.rsplit('_', 2)):
+            n_lines += makeWavLines(wavs[x], target_dir, clip_length, interval, outfile)
+
+    print("{0:,} lines written to {1}.".format(n_lines, os.path.basename(output_path)))
 
 
 if __name__ == "__main__":
@@ -47,11 +47,9 @@ def main():
     else:
         print("Renaming {0} files... ".format(len(wavs)), end='')
         
-        log_lines = ["Folder,Old_Filename,New_Filename"]
-        log_lines.extend(map(pnwtools.renameWav, wavs))
-
         with open(rename_log_path, 'w') as log_file:
-            log_file.write('\n'.join(log_lines))
+            log_file.write("Folder,Old_Filename,New_Filename\n")
+            pnwtools.renameWavs(wavs, log_file)
 
         print("done.")
 
@@ -60,11 +58,11 @@ def main():
     if make_info_file.lower() != 'n':
         stn_info_path = os.path.join(target_dir, "{0}_station_info.csv".format(dir_name))
         
-        stn_info = pnwtools.buildStationDict(target_dir)
+        stn_info = pnwtools.buildStationDictCached(target_dir)
         stn_info_lines = pnwtools.buildStationTable(stn_info)
 
         with open(stn_info_path, 'w') as stn_info_file:
-            stn_info_file.write('\n'.join(stn_info_lines))
+            stn_info_file.writelines(line + '\n' for line in stn_info_lines)
 
         os.startfile(stn_info_path, 'open')
 
@@ -10,26 +10,123 @@ for ease of discovery.
 :license: GNU General Public License v3; see LICENSE for details.
 """
 
-import chunk
+import csv
+import json
+import mmap
 import os
 import re
 import struct
+import sys
+import threading
 import wave
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from guano import GuanoFile
+from math import log10
 
 
 ################################################################################
 ########### Miscellaneous functions for dealing with .wav files ################
 
-def findWavs(top_dir):
-    """Get a sorted list of .wav files within a directory tree."""
-    wavs = []
-    for root, dirs, files in os.walk(top_dir):
-        for file in files:
-            if file[-4:].lower() == ".wav":
-                wavs.append(os.path.join(root, file))
-    return sorted(wavs)
+# Preferred .wav filename format, [Area]_[Hex ID]-[Stn ID]_YYYYMMDD_HHMMSS.wav,
+# capturing area, hex ID, station ID, date and time
+_WAV_PATT = re.compile(r"([A-Z]{3,5})_([0-9]{5})-([A-Z0-9]+?)_([0-9]{8})_([0-9]{6})\.wav")
+
+
+def _is_wav_name(name):
+    """Check whether a filename has a .wav extension, in any case."""
+    return name[-4:].lower() == ".wav"
+
+
+def _list_wav_dir(dir_path, stats=False):
+    """List the subdirectories and .wav files in a directory, sorted.
+    
+    Returns (sort key, path, is_dir) tuples; if `stats` is True, each 
+    .wav path is a (path, size, mtime_ns) tuple instead.
+    """
+    children = []
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    children.append((entry.name + os.sep, entry.path, True))
+                elif _is_wav_name(entry.name):
+                    if stats:
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        children.append((entry.name, (entry.path, st.st_size, st.st_mtime_ns), False))
+                    else:
+                        children.append((entry.name, entry.path, False))
+    except OSError:
+        return []
+    children.sort()
+    return children
+
+
+def _walk_wavs(top_dir, list_dir=_list_wav_dir):
+    """Yield paths to .wav files within a directory tree, in sorted order.
+    
+    `list_dir` gets the sorted entries for a directory.
+    """
+    stack = [(top_dir, True)]
+    while stack:
+        path, is_dir = stack.pop()
+        if not is_dir:
+            yield path
+            continue
+        stack.extend((child_path, child_is_dir) 
+                     for key, child_path, child_is_dir in reversed(list_dir(path)))
+
+
+def _walk_wavs_threaded(top_dir, threads, stats=False):
+    """Collect paths to .wav files in sorted order using `threads` workers."""
+    pending = deque([top_dir])
+    listings = {}
+    n_busy = 0
+    cond = threading.Condition()
+
+    def worker():
+        nonlocal n_busy
+        while True:
+            with cond:
+                while not pending and n_busy > 0:
+                    cond.wait()
+                if not pending:
+                    return
+                dir_path = pending.pop()
+                n_busy += 1
+            
+            children = None
+            try:
+                children = _list_wav_dir(dir_path, stats)
+            finally:
+                with cond:
+                    if children is not None:
+                        listings[dir_path] = children
+                        pending.extend(path for key, path, is_dir in children if is_dir)
+                    n_busy -= 1
+                    cond.notify_all()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(worker) for i in range(threads)]:
+            future.result()
+
+    return list(_walk_wavs(top_dir, listings.__getitem__))
+
+
+def findWavs(top_dir, threads=32, stats=False):
+    """Get a sorted list of .wav files within a directory tree.
+    
+    The tree is walked by `threads` worker threads; use threads=1 to 
+    walk it from the calling thread only. If `stats` is True, each item
+    is a (path, size, mtime_ns) tuple instead of just the path.
+    """
+    if threads > 1:
+        return _walk_wavs_threaded(top_dir, threads, stats)
+    else:
+        return list(_walk_wavs(top_dir, lambda path: _list_wav_dir(path, stats)))
 
 
 def makeWavDict(top_dir):
@@ -41,6 +138,26 @@ def makeWavDict(top_dir):
     return wav_dict
 
 
+def _stamp_from_digits(date, time):
+    """Build a datetime from "YYYYMMDD" and "HHMMSS" digit strings."""
+    return datetime(int(date[0:4]), int(date[4:6]), int(date[6:8]), 
+                    int(time[0:2]), int(time[2:4]), int(time[4:6]))
+
+
+def _parse_stamp(str_stamp):
+    """Parse a "YYYYMMDD_HHMMSS.wav" string into a datetime.
+    
+    Slices the fixed-width fields directly, which is much quicker than
+    strptime; anything not in exactly that layout is passed on to 
+    strptime, which raises ValueError if it can't be read either.
+    """
+    s = str_stamp
+    if (len(s) == 19 and s[8] == '_' and s[15:] == '.wav' 
+            and s[:8].isdigit() and s[9:15].isdigit()):
+        return _stamp_from_digits(s[:8], s[9:15])
+    return datetime.strptime(s, "%Y%m%d_%H%M%S.wav")
+
+
 def getStamp(wav_path):
     """Get the timestamp of a .wav file.
     
@@ -49,9 +166,12 @@ def getStamp(wav_path):
     will be the .wav file's last modification time.
     
     """
-    str_stamp = '_'.join(wav_path.split('_')[-2:])
+    match = _WAV_PATT.match(os.path.basename(wav_path))
     try:
-        stamp = datetime.strptime(str_stamp, "%Y%m%d_%H%M%S.wav")
+        if match:
+            stamp = _stamp_from_digits(match.group(4), match.group(5))
+        else:
+            stamp = _parse_stamp('_'.join(wav_path.split('_')[-2:]))
     except:
         wav_mtime = os.path.getmtime(wav_path)
         stamp = datetime.fromtimestamp(wav_mtime)
@@ -67,13 +187,90 @@ def getStn(wav_path):
     return stn
 
 
+def _read_prefix(wav_path, n=65536):
+    """Read the first `n` bytes of a file in a single read call.
+    
+    The header of a .wav file and any WAMD metadata normally sit well 
+    within the first 64 KB, so this one read is usually all that is 
+    needed to check the file, get its duration and find its serial 
+    number. Returns the bytes read and the total size of the file.
+    """
+    with open(wav_path, 'rb', buffering=0) as f:
+        return f.read(n), os.fstat(f.fileno()).st_size
+
+
+def _is_riff_wave(buf):
+    """Check that a buffer starts with a RIFF header of type WAVE."""
+    return buf[0:4] == b'RIFF' and buf[8:12] == b'WAVE'
+
+
+def _find_chunk(buf, chunk_id):
+    """Locate a RIFF subchunk within the contents of a .wav file.
+    
+    Hops from one chunk header to the next, starting right after the 
+    'WAVE' tag, so only the headers are touched. Returns the offset and
+    size of the chunk's data, or None if there is no such chunk.
+    """
+    offset = 12
+    while offset + 8 <= len(buf):
+        size = struct.unpack_from('<I', buf, offset+4)[0]
+        if buf[offset:offset+4] == chunk_id:
+            return offset + 8, size
+        offset += 8 + size + (size & 1) # Chunks are padded to even sizes
+    return None
+
+
+def _chunk_walk_end(buf):
+    """Find where a chunk walk runs off the end of a partial .wav buffer.
+    
+    Returns the offset of the first chunk whose header or data is not 
+    entirely within `buf`, i.e. where the walk has to carry on in the
+    file itself. This is usually the 'data' chunk.
+    """
+    offset = 12
+    while offset + 8 <= len(buf):
+        size = struct.unpack_from('<I', buf, offset+4)[0]
+        if offset + 8 + size > len(buf):
+            break
+        offset += 8 + size + (size & 1)
+    return offset
+
+
+def _wav_length_from_buf(buf):
+    """Calculate the duration of a .wav file from the start of its contents.
+    
+    Returns None unless `buf` holds a PCM 'fmt ' chunk and the header of
+    the 'data' chunk, in which case the caller should fall back to the
+    `wave` module.
+    """
+    fmt, data = _find_chunk(buf, b'fmt '), _find_chunk(buf, b'data')
+    if not (_is_riff_wave(buf) and fmt and data):
+        return None
+    offset, fmt_size = fmt
+    if fmt_size < 16 or offset + 16 > len(buf):
+        return None
+    audio_format, n_channels, sample_rate = struct.unpack_from('<HHI', buf, offset)
+    bits_per_sample = struct.unpack_from('<H', buf, offset+14)[0]
+    frame_size = n_channels * ((bits_per_sample + 7) // 8)
+    if audio_format != 1 or frame_size == 0 or sample_rate == 0:
+        return None
+    return float(data[1] // frame_size) / sample_rate
+
+
+def _check_wav_buf(buf, file_size):
+    """Check validity of a .wav file given the start of its contents."""
+    return file_size != 262144 and _is_riff_wave(buf)
+
+
 def getWavLength(wav_path):
     """Calculate the duration of a .wav file in seconds."""
     try:
-        w = wave.open(wav_path)
-        n_samples, sample_rate = w.getnframes(), w.getframerate()
-        w.close()
-        wav_length = float(n_samples) / sample_rate
+        wav_length = _wav_length_from_buf(_read_prefix(wav_path)[0])
+        if wav_length is None:
+            w = wave.open(wav_path)
+            n_samples, sample_rate = w.getnframes(), w.getframerate()
+            w.close()
+            wav_length = float(n_samples) / sample_rate
     except:
         wav_length = 0
     return wav_length
@@ -81,20 +278,10 @@ def getWavLength(wav_path):
 
 def checkWav(wav_path):
     """Check to make sure wav_path is a valid wav file."""
-    if os.path.getsize(wav_path) == 262144:
+    try:
+        valid = _check_wav_buf(*_read_prefix(wav_path, 12))
+    except:
         valid = False
-    else:
-        try:
-            with open(wav_path, 'rb') as f:
-                ch = chunk.Chunk(f, bigendian=False)
-                if ch.getname() != b'RIFF':
-                    valid = False
-                elif ch.read(4) != b'WAVE':
-                    valid = False
-                else:
-                    valid = True
-        except:
-            valid = False
     return valid
 
 
@@ -103,8 +290,7 @@ def checkWavFilename(filename, folder):
     
     Preferred format is [Area]_[Hex ID]-[Stn ID]_YYYYMMDD_HHMMSS.wav.
     """
-    filename_patt = re.compile("[A-Z]{3,5}_[0-9]{5}-[A-Z0-9]+?_[0-9]{8}_[0-9]{6}.wav")
-    if filename_patt.match(filename):
+    if _WAV_PATT.match(filename):
         hex_dir, stn_dir = folder.split('/')[-2:]
         stn_id = stn_dir.split('_')[-1]
         prefix = "{0}-{1}".format(hex_dir, stn_id)
@@ -114,8 +300,12 @@ def checkWavFilename(filename, folder):
         return False
 
 
-def makeWavLines(wav_path, target_dir, clip_length, interval):
-    """Create a table listing short segments of a wav file for review.
+def makeWavLines(wav_path, target_dir, clip_length, interval, out):
+    """Write lines listing short segments of a wav file for review.
+    
+    Lines are written directly to `out`, which can be an open file or
+    any other object with a write() method, e.g. io.StringIO. Returns
+    the number of lines written.
     
     Setting `interval` to less than `clip_length` allows segments to
     overlap, which can be useful.
@@ -123,21 +313,19 @@ def makeWavLines(wav_path, target_dir, clip_length, interval):
     """
     fdir, fname = os.path.split(wav_path)
     folder = fdir.replace(target_dir + os.sep, "")
-    wav_length = pnwtools.getWavLength(wav_path)
-    if wav_length == 0:
-        output_lines = []
-    else:
-        n_part_digits = int(log10(wav_length / interval)) + 1
-        n_pos_digits = int(log10(wav_length)) + 1
-        output_lines = []
+    wav_length = getWavLength(wav_path)
+    n_lines = 0
+    if wav_length > 0:
+        prefix = f"{folder},{fname},0,"
+        if clip_length == interval:
+            n_digits = max(int(log10(wav_length / interval)) + 1, 1)
+            make_part = lambda i, offs: f"part_{i:0{n_digits}d}"
+        else:
+            n_digits = max(int(log10(wav_length)) + 1, 1)
+            make_part = lambda i, offs: f"pos_{int(offs):0{n_digits}d}"
         i = 1
         while True:
             offs = (i - 1) * interval
-            if clip_length == interval:
-                str_part = "part_%s" % str(i).zfill(n_part_digits)
-            else:
-                str_part = "pos_%s" % str(int(offs)).zfill(n_pos_digits)
-            
             if offs + clip_length < wav_length:
                 dur = clip_length
             else:
@@ -145,15 +333,30 @@ def makeWavLines(wav_path, target_dir, clip_length, interval):
                 if dur < clip_length:
                     break
             
-            new_line = "{0},{1},0,{2},{3},{4},1,".format(folder, fname, offs, dur, str_part)
-            output_lines.append(new_line)
+            out.write(f"{prefix}{offs},{dur},{make_part(i, offs)},1,\n")
+            n_lines += 1
             i = i + 1
 
-    return output_lines
+    return n_lines
 
 ################################################################################
 ############## Functions for renaming a set of .wav files ######################
 
+def newWavPath(old_path):
+    """Get the path that renameWav would move a .wav file to."""
+    
+    wav_dir, old_name = os.path.split(old_path)
+    old_name = old_name.replace('$', '_')
+    
+    hex_id, stn_dir = wav_dir.split(os.sep)[-2:]
+    stn_id = stn_dir.split('_')[-1]
+    
+    str_stamp = '_'.join(old_name.split('_')[-2:])
+    
+    new_name = "{0}-{1}_{2}".format(hex_id, stn_id, str_stamp)
+    return os.path.join(wav_dir, new_name)
+
+
 def renameWav(old_path):
     """Intelligently rename a .wav file.
     
@@ -168,21 +371,59 @@ def renameWav(old_path):
     
     wav_dir, old_name = os.path.split(old_path)
     old_name = old_name.replace('$', '_')
-    
-    hex_id, stn_dir = wav_dir.split(os.sep)[-2:]
-    stn_id = stn_dir.split('_')[-1]
-    
-    str_stamp = '_'.join(old_name.split('_')[-2:])
-    
-    new_name = "{0}-{1}_{2}".format(hex_id, stn_id, str_stamp)
-    new_path = os.path.join(wav_dir, new_name)
+    new_path = newWavPath(old_path)
 
     if new_path != old_path:
         os.rename(old_path, new_path)
     else:
         pass
 
-    return "{0},{1},{2}".format(wav_dir, old_name, new_name)
+    return "{0},{1},{2}".format(wav_dir, old_name, os.path.basename(new_path))
+
+
+def _rename_in_order(old_paths):
+    """Rename .wav files one at a time, stopping at the first failure.
+    
+    Returns the log lines for the files that were renamed, and the 
+    exception that stopped the loop or None.
+    """
+    log_lines = []
+    for old_path in old_paths:
+        try:
+            log_lines.append(renameWav(old_path))
+        except Exception as e:
+            return log_lines, e
+    return log_lines, None
+
+
+# renameWavs hands out this many renames to its workers at a time, and 
+# does not start another batch once one of them has failed.
+RENAME_BATCH_SIZE = 256
+
+
+def renameWavs(wavs, log_file, threads=32):
+    """Rename a list of .wav files, writing a log line for each one.
+    
+    Uses `threads` workers; the first failed rename is raised once the 
+    renames in progress have finished.
+    """
+    groups = {}
+    for wav in wavs:
+        groups.setdefault(newWavPath(wav), []).append(wav)
+    groups = list(groups.values())
+    
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for start in range(0, len(groups), RENAME_BATCH_SIZE):
+            batch = groups[start:start + RENAME_BATCH_SIZE]
+            futures = [executor.submit(_rename_in_order, group) for group in batch]
+            
+            error = None
+            for future in futures:
+                log_lines, e = future.result()
+                log_file.writelines(line + '\n' for line in log_lines)
+                error = error or e
+            if error is not None:
+                raise error
 
 
 def undoRename(log_path):
@@ -207,46 +448,141 @@ def undoRename(log_path):
 ################################################################################
 ############# Functions for summarizing a set of .wav files ####################
 
-def buildStationDict(top_dir):
-    """Build a dictionary of info about .wav files in a directory."""
-    
-    wavs = findWavs(top_dir)
-    good_wavs = list(filter(checkWav, wavs))
-    stns = sorted(list(set(map(getStn, good_wavs))))
+# Everything buildStationDict needs to know about a single .wav file.
+# stn, stamp and serial are None if the file is not a valid .wav file.
+WavInfo = namedtuple("WavInfo", ["path", "stn", "stamp", "serial", "valid"])
 
-    stn_dict = dict(zip(stns, [{'dates':[], 'serials':[], 'n_wavs':0} for i in stns]))
 
-    for wav in good_wavs:
-        stn, stamp = getStn(wav), getStamp(wav)
-        stn_dict[stn]['dates'].append(stamp)
-        stn_dict[stn]['n_wavs'] += 1
+def readWavInfo(wav_path):
+    """Collect station, timestamp, serial number and validity of a .wav."""
+    try:
+        buf, file_size = _read_prefix(wav_path)
+    except OSError:
+        return WavInfo(wav_path, None, None, None, False)
+
+    if not _check_wav_buf(buf, file_size):
+        return WavInfo(wav_path, None, None, None, False)
+
+    metadata = _read_metadata(buf)
+    resume_offset = _chunk_walk_end(buf)
+    if _serial_from_metadata(metadata) == "NA" and resume_offset < file_size:
+        # Chunks from here on (e.g. a 'guan' chunk after the audio data) 
+        # were not fully read with the prefix, so walk through the rest
+        # of them in the file without reading the audio itself
         try:
-            serial = getSerial(wav)
-            stn_dict[stn]['serials'].append(serial)
-        except:
+            with open(wav_path, 'rb') as f:
+                more_metadata = _read_metadata_from(f, resume_offset, file_size)
+            for key in metadata:
+                metadata[key] = metadata[key] or more_metadata[key]
+        except OSError:
             pass
+    serial = _serial_from_metadata(metadata)
+
+    return WavInfo(wav_path, getStn(wav_path), getStamp(wav_path), serial, True)
+
+
+def scanWavs(top_dir):
+    """Generate a WavInfo for each .wav file within a directory tree."""
+    for wav_path in findWavs(top_dir):
+        yield readWavInfo(wav_path)
+
+
+def _collect_stations(wav_infos):
+    """Tally WavInfo records into a dictionary of info by station.
+    
+    Timestamps from before 2017 are left out of each station's dates, 
+    though those files still count toward its number of valid .wavs.
+    """
+    
+    stn_dict = {}
+
+    for info in wav_infos:
+        if not info.valid:
+            continue
+        stn_info = stn_dict.setdefault(info.stn, {'dates':[], 'serials':[], 'n_wavs':0})
+        if info.stamp.year >= 2017:
+            stn_info['dates'].append(info.stamp)
+        stn_info['serials'].append(info.serial)
+        stn_info['n_wavs'] += 1
+
+    return stn_dict
+
+
+def buildStationDict(top_dir):
+    """Build a dictionary of info about .wav files in a directory.
+    
+    Each station's 'dates' list leaves out timestamps from before 2017,
+    but those files are still counted in 'n_wavs'.
+    """
+    return _collect_stations(scanWavs(top_dir))
+
+
+# Station info is cached as JSON in this file within the target 
+# directory, along with the path, size and modification time of each 
+# .wav file it was built from. Bump the version if the contents of the
+# cache change.
+STATION_CACHE_NAME = ".pnwtools_cache.json"
+STATION_CACHE_VERSION = 1
+
+
+def buildStationDictCached(top_dir):
+    """Build a dictionary of info about .wav files, reusing earlier results.
+    
+    The result is reused while the tree holds the same .wav files, with 
+    the same sizes and modification times.
+    """
+    wav_stats = [list(x) for x in findWavs(top_dir, stats=True)]
+    wavs = [path for path, size, mtime_ns in wav_stats]
+    cache_path = os.path.join(top_dir, STATION_CACHE_NAME)
+
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+        if cache["version"] == STATION_CACHE_VERSION and cache["wavs"] == wav_stats:
+            return {stn: {'dates': [datetime.fromisoformat(d) for d in info['dates']],
+                          'serials': [str(x) for x in info['serials']],
+                          'n_wavs': int(info['n_wavs'])}
+                    for stn, info in cache["stations"].items()}
+    except:
+        pass
+
+    stn_dict = _collect_stations(map(readWavInfo, wavs))
+
+    cache = {
+        "version": STATION_CACHE_VERSION,
+        "wavs": wav_stats,
+        "stations": {stn: {'dates': [d.isoformat() for d in info['dates']],
+                           'serials': info['serials'],
+                           'n_wavs': info['n_wavs']}
+                     for stn, info in stn_dict.items()}
+        }
+    try:
+        with open(cache_path, 'w') as cache_file:
+            json.dump(cache, cache_file)
+    except OSError:
+        pass
 
     return stn_dict
 
 
 def buildStationTable(stn_dict):
-    """Summarize info on .wavs in a directory tree in table form."""
+    """Summarize info on .wavs in a directory tree in table form.
+    
+    Lines of the table are generated one at a time, header first.
+    """
 
-    stn_info_lines = ["Station ID,Valid wavs,Earliest,Latest,Serial number"]
+    yield "Station ID,Valid wavs,Earliest,Latest,Serial number"
     
     stns = sorted(stn_dict.keys())
 
     for stn in stns:
         stn_dates = stn_dict[stn]['dates']
-        good_dates = list(filter(lambda d: d.year >= 2017, stn_dates))
-        first_date, last_date = min(good_dates), max(good_dates)
-        str_first = first_date.strftime("%m/%d/%y")
-        str_last = last_date.strftime("%m/%d/%y")
+        first_date, last_date = min(stn_dates), max(stn_dates)
+        str_first = f"{first_date.month:02d}/{first_date.day:02d}/{first_date.year % 100:02d}"
+        str_last = f"{last_date.month:02d}/{last_date.day:02d}/{last_date.year % 100:02d}"
         serials = '+'.join(list(set(stn_dict[stn]['serials'])))
         n_wavs = stn_dict[stn]['n_wavs']
-        stn_info_lines.append("{0},{1},{2},{3},{4}".format(stn, n_wavs, str_first, str_last, serials))
-
-    return stn_info_lines
+        yield f"{stn},{n_wavs},{str_first},{str_last},{serials}"
 
 
 ################################################################################
@@ -267,46 +603,49 @@ def countTags(tagged_file_path):
         number of tagged lines, and the number of unique tags used; and
         tag_counts, indexed by tag and by folder (from the FOLDER field
         of the review file), listing the number of instances of each 
-        unique tag.
+        unique tag. Folders where a tag does not occur are left out of
+        that tag's counts.
     """
 
-    with open(tagged_file_path) as tagged_file:
-        lines = [line.replace('"', '').rstrip() for line in tagged_file.readlines()]
+    with open(tagged_file_path, newline='') as tagged_file:
+        reader = csv.reader(tagged_file)
+        headers = [x.strip().replace(' ', '_').replace('*', '').upper() for x in next(reader, [])]
+        n_fields = len(headers)
+        n_lines = 0
+        n_tagged_lines = 0
+        folders = set()
+        tag_counts = defaultdict(Counter)
 
-    headers = [x.replace(' ', '_').replace('*', '').upper() for x in lines[0].split(',')]
-    n_fields = len(headers)
-    n_lines = len(lines) - 1
-    n_tagged_lines = 0
-    tag_counts = {}
-
-    try:
-        manid_field = headers.index("MANUAL_ID")
-        infile_field = headers.index("IN_FILE")
-        folder_field = headers.index("FOLDER")
-    except:
-        print("Required fields were not found in the file specified.")
-        return
-
-    folders = list(set([line.split(',')[folder_field] for line in lines[1:]]))
-
-    for line in lines[1:]:
-        vals = line.split(',')
-        n_vals = len(vals)
-
-        filename, folder = vals[infile_field], vals[folder_field]
-        if folder == '':
-            folder = "NA"
-
-        n_comma_tags = n_vals - n_fields
-        labels = '+'.join(vals[manid_field : manid_field + n_comma_tags + 1])
-
-        if labels != '':
-            n_tagged_lines += 1
-            tags = labels.split('+')
-            for tag in tags:
-                if not tag in tag_counts:
-                    tag_counts[tag] = dict(zip(folders, [0 for i in folders]))
-                tag_counts[tag][folder] += 1
+        try:
+            manid_field = headers.index("MANUAL_ID")
+            infile_field = headers.index("IN_FILE")
+            folder_field = headers.index("FOLDER")
+        except:
+            print("Required fields were not found in the file specified.")
+            return
+
+        for vals in reader:
+            if not vals:
+                continue
+            n_lines += 1
+            n_vals = len(vals)
+            vals[-1] = vals[-1].rstrip()
+
+            filename, folder = vals[infile_field], vals[folder_field]
+            if folder == '':
+                folder = "NA"
+            folders.add(folder)
+
+            # Tags may be separated by '+' or by commas, which either end 
+            # up inside a quoted MANUAL_ID or spill over into extra fields
+            n_comma_tags = n_vals - n_fields
+            labels = '+'.join(vals[manid_field : manid_field + n_comma_tags + 1]).replace(',', '+')
+
+            if labels != '':
+                n_tagged_lines += 1
+                tags = labels.split('+')
+                for tag in tags:
+                    tag_counts[tag][folder] += 1
 
     file_info = {
         "file_path": tagged_file_path,
@@ -318,7 +657,7 @@ def countTags(tagged_file_path):
         "unique_tags": len(tag_counts)
         }
 
-    results = {"file_info": file_info, "tag_counts": tag_counts}
+    results = {"file_info": file_info, "tag_counts": dict(tag_counts)}
 
     return results
 
@@ -340,16 +679,21 @@ def summarizeTags(tag_count_dict):
 
     str_mtime = datetime.fromtimestamp(finfo["file_mtime"]).strftime("%b %d at %H:%M")
 
-    print("\nFile {0} was last saved {1}.".format(finfo["file_name"], str_mtime))
-    print("{0:,} of {1:,} lines are tagged.\n".format(finfo["tagged_lines"], finfo["total_lines"]))
+    out_lines = [
+        "\nFile {0} was last saved {1}.".format(finfo["file_name"], str_mtime),
+        "{0:,} of {1:,} lines are tagged.\n".format(finfo["tagged_lines"], finfo["total_lines"])
+        ]
     
     if finfo["tagged_lines"] > 0:
-        print("{0} unique tags were used:\n".format(finfo["unique_tags"]))
-        print("Tag\t\t{0}".format('\t\t'.join(folders)))
+        out_lines.append("{0} unique tags were used:\n".format(finfo["unique_tags"]))
+        out_lines.append("Tag\t\t{0}".format('\t\t'.join(folders)))
         for label in sorted(tag_counts, key = lambda x: ("?" in x, x)):
-            counts = '\t\t'.join([str(tag_counts[label][f]) for f in folders])
-            print("{0}\t\t{1}".format(label, counts))
-        print("")
+            counts = '\t\t'.join(str(tag_counts[label].get(f, 0)) for f in folders)
+            out_lines.append("{0}\t\t{1}".format(label, counts))
+        out_lines.append("")
+
+    # Write the whole summary at once rather than line by line
+    sys.stdout.write('\n'.join(out_lines) + '\n')
 
     return
 
@@ -357,8 +701,8 @@ def summarizeTags(tag_count_dict):
 ################################################################################
 ########## Functions for dealing with .wav metadata (WAMD and GUANO) ###########
 
-# The complicated stuff is lifted from the `wamd2guano` script that is 
-# included in the `guano` package.
+# The WAMD field definitions are lifted from the `wamd2guano` script 
+# that is included in the `guano` package.
 
 # binary WAMD field identifiers
 WAMD_IDS = {
@@ -388,45 +732,124 @@ def _parse_text(value):
     return value.decode('utf-8')
 
 
+def _parse_wamd(buf):
+    """Decode the data of a 'wamd' chunk into a dict."""
+    metadata = {}
+    offset = 0
+    size = len(buf)
+    while offset < size:
+        id = struct.unpack_from('< H', buf, offset)[0]
+        len_ = struct.unpack_from('< I', buf, offset+2)[0]
+        val = struct.unpack_from('< %ds' % len_, buf, offset+6)[0]
+        if id not in WAMD_DROP_IDS:
+            name = WAMD_IDS.get(id, id) # Return id if it isn't a valid key
+            val = WAMD_COERCE.get(name, _parse_text)(val)
+            metadata[name] = val
+        offset += 6 + len_
+    return metadata
+
+
+def _parse_guano(buf):
+    """Decode the data of a 'guan' chunk into a dict of text fields.
+    
+    GUANO metadata is UTF-8 text with one "Key: Value" pair per line.
+    """
+    metadata = {}
+    text = bytes(buf).decode('utf-8', errors='replace').strip('\0 ')
+    for line in text.splitlines():
+        key, sep, val = line.partition(':')
+        if sep:
+            metadata[key.strip()] = val.strip()
+    return metadata
+
+
+# Metadata chunks we know how to read: key in the metadata dict, RIFF 
+# chunk ID and the function that decodes the chunk's data
+METADATA_CHUNKS = (
+    ("wamd", b'wamd', _parse_wamd),
+    ("guano", b'guan', _parse_guano)
+)
+
+
+def _read_metadata(buf):
+    """Pull WAMD and GUANO metadata out of the contents of a .wav file.
+    
+    Returns a dict with keys "wamd" and "guano"; each is a dict, empty
+    if that kind of metadata is missing or unreadable. `buf` may hold 
+    just the start of the file, in which case chunks that run past its 
+    end are treated as missing.
+    """
+    metadata = {"wamd": {}, "guano": {}}
+    for key, chunk_id, parse in METADATA_CHUNKS:
+        loc = _find_chunk(buf, chunk_id)
+        if loc and loc[0] + loc[1] <= len(buf):
+            offset, size = loc
+            try:
+                metadata[key] = parse(buf[offset:offset+size])
+            except:
+                pass
+    return metadata
+
+
+def _read_metadata_from(f, offset, file_size):
+    """Pull WAMD and GUANO metadata from an open .wav file, from `offset` on.
+    
+    Carries on a chunk walk in the file itself, seeking from one chunk 
+    header to the next and reading only the metadata chunks, so e.g. a
+    'guan' chunk after the audio data costs a couple of small reads. 
+    Returns a dict like _read_metadata does.
+    """
+    metadata = {"wamd": {}, "guano": {}}
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, size = header[:4], struct.unpack_from('<I', header, 4)[0]
+        for key, metadata_id, parse in METADATA_CHUNKS:
+            if chunk_id == metadata_id:
+                try:
+                    metadata[key] = parse(f.read(size))
+                except:
+                    pass
+        offset += 8 + size + (size & 1)
+    return metadata
+
+
+def _serial_from_metadata(metadata):
+    """Pick the ARU serial number out of _read_metadata output."""
+    serial = metadata["wamd"].get("serial") or metadata["guano"].get("Serial")
+    return serial if serial else "NA"
+
+
+def getWavMetadata(fpath):
+    """Extract WAMD and GUANO metadata from a .wav file.
+    
+    The file is memory-mapped and searched in place, so only the chunk
+    headers and the metadata chunks themselves are actually read. 
+    Returns a dict like {"wamd": {...}, "guano": {...}}.
+    """
+    with open(fpath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if not _is_riff_wave(buf):
+            raise Exception('%s is not a RIFF WAVE file!' % fpath)
+        return _read_metadata(buf)
+
+
 def wamd(fname):
     """Extract WAMD metadata from a .WAV file as a dict."""
-    with open(fname, 'rb') as f:
-        # Just checking the first chunk to make sure this is a wave file
-        ch = chunk.Chunk(f, bigendian=False)
-        if ch.getname() != b'RIFF':
+    with open(fname, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if buf[0:4] != b'RIFF':
             raise Exception('%s is not a RIFF file!' % fname)
-        if ch.read(4) != b'WAVE':
+        if buf[8:12] != b'WAVE':
             raise Exception('%s is not a WAVE file!' % fname)
 
         # Look for a chunk called 'wamd' which contains the WAMD metadata
-        wamd_chunk = None
-        while True:
-            try:
-                subch = chunk.Chunk(ch, bigendian=False)
-            except EOFError:
-                break
-            if subch.getname() == b'wamd':
-                wamd_chunk = subch
-                break
-            else:
-                subch.skip()
-        if not wamd_chunk:
+        loc = _find_chunk(buf, b'wamd')
+        if not loc:
             raise Exception('"wamd" WAV chunk not found in file %s' % fname)
 
-        metadata = {}
-        offset = 0
-        size = wamd_chunk.getsize()
-        buf = wamd_chunk.read(size)
-        while offset < size:
-            id = struct.unpack_from('< H', buf, offset)[0]
-            len = struct.unpack_from('< I', buf, offset+2)[0]
-            val = struct.unpack_from('< %ds' % len, buf, offset+6)[0]
-            if id not in WAMD_DROP_IDS:
-                name = WAMD_IDS.get(id, id) # Return id if it isn't a valid key
-                val = WAMD_COERCE.get(name, _parse_text)(val)
-                metadata[name] = val
-            offset += 6 + len
-        return metadata
+        offset, size = loc
+        return _parse_wamd(buf[offset:offset+size])
 
 
 def getSerial(fpath):
@@ -437,11 +860,7 @@ def getSerial(fpath):
     """
     
     try:
-        serial = wamd(fpath)["serial"]
+        serial = _serial_from_metadata(getWavMetadata(fpath))
     except:
-        try:
-            gf = GuanoFile(fpath)
-            serial = gf["Serial"]
-        except:
-            serial = "NA"
+        serial = "NA"
     return serial